@@ -1,52 +1,133 @@
 """Build, compile and run C2C all-reduce collective op for fully connected n-way topology."""
 
 import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import importlib.metadata
 import numpy as np
+import os
 import sys
-
-import groq.api as g
-import groq.runner.tsp as tsp  # pylint: disable=import-error
-from groq.common import print_utils
-from groq.common.config import config
 import time
 
+# The groq SDK imports are deferred to the functions that need them so that
+# importing this module does not initialize the SDK.
+
+# Supported topologies, keyed by the --topo_str value and mapped to the name
+# of the matching g.TopologyConfig member.
+TOPOLOGY_CONFIGS = {
+    "A11_2C": "FC2_A11_2_CHIP",
+    "A11_4C": "FC2_A11_4_CHIP",
+    "A14_2C": "DF_A14_2_CHIP",
+    "A14_4C": "DF_A14_4_CHIP",
+    "A14_8C": "DF_A14_8_CHIP",
+}
+
+# Relative tolerance used to validate results against the oracle.
+RTOL = 1e-5
+
+# Marker written once a cached package has been assembled successfully. It
+# holds the cache key of the assembled package.
+ASSEMBLED_MARKER = ".assembled"
+
+
+def create_data(input_tensors, result_tensors, seed=None):
+    # `seed` may be an int, None or a np.random.SeedSequence shared by the caller.
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    # All input tensors share the same shape and dtype.
+    shape = input_tensors[0].shape
+    nptype = input_tensors[0].dtype.to_nptype()
+
+    # Create random data for each input tensor. Every device's slice is
+    # filled on its own thread with a generator spawned from `seed`, so
+    # threads get independent streams and never share generator state; numpy
+    # releases the GIL while generating and scaling.
+    num_devs = len(input_tensors)
+    input_data = np.empty((num_devs, *shape), dtype=np.float32)
+    dev_rngs = [np.random.default_rng(ss) for ss in seed.spawn(num_devs)]
+
+    def fill(dev_num):
+        dev_data = input_data[dev_num]
+        dev_rngs[dev_num].random(dtype=np.float32, out=dev_data)
+        dev_data *= np.float32(10.0)
 
-def create_data(input_tensors, result_tensors):
-    # Create random data for each input tensor.
-    input_data = []
-    for input_t in input_tensors:
-        shape = input_t.shape
-        nptype = input_t.dtype.to_nptype()
-        data = (np.random.rand(*shape) * 10.0).astype(nptype)
-        input_data.append(data)
+    with ThreadPoolExecutor(max_workers=num_devs) as executor:
+        list(executor.map(fill, range(num_devs)))
+
+    # No copy is made when the tensors are float32.
+    input_data = input_data.astype(nptype, copy=False)
 
     # Build input dictionary.
-    inputs = {input_t.name: data for input_t, data in zip(input_tensors, input_data)}
+    inputs = {input_t.name: input_data[i] for i, input_t in enumerate(input_tensors)}
+
+    # Build oracle from src data. Every result tensor holds the same
+    # all-reduce output, so a single oracle is shared by all of them.
+    oracle_data = input_data.sum(axis=0, dtype=input_data.dtype)
+    result_names = [mt.name for mt in result_tensors]
+
+    return inputs, oracle_data, result_names
+
 
-    # Build oracle from src data.
-    input_data = np.expand_dims(input_data, axis=0)
-    oracle_data = np.concatenate(np.array(input_data), axis=0).sum(axis=0)
-    oracles = {mt.name: oracle_data for mt in result_tensors}
+# Buffers reused by check_results across iterations: the stacked |result -
+# oracle| errors, the comparison mask and the elementwise tolerance.
+CheckBuffers = namedtuple("CheckBuffers", ["scratch", "mask", "tol"])
 
-    return inputs, oracles
 
+def create_check_buffers(oracle_data, num_results):
+    scratch = np.empty((num_results, *oracle_data.shape), oracle_data.dtype)
+    mask = np.empty(scratch.shape, dtype=bool)
+    tol = RTOL * np.abs(oracle_data)
+    return CheckBuffers(scratch, mask, tol)
+
+
+def check_results(results, oracle_data, result_names, buffers=None) -> bool:
+    # Every device receives the same all-reduce result, so validate them all
+    # with a single comparison and only fall back to per-tensor checks to
+    # report mismatches. Pass `buffers` from create_check_buffers() to reuse
+    # them across iterations.
+    from groq.common import print_utils
+
+    # Missing results and shape mismatches can't be stacked; leave them to
+    # the per-tensor checks below, which report them.
+    stackable = all(
+        name in results and np.shape(results[name]) == oracle_data.shape
+        for name in result_names
+    )
+    if stackable:
+        if buffers is None:
+            buffers = create_check_buffers(oracle_data, len(result_names))
+        scratch, mask, tol = buffers
+        np.stack([results[name] for name in result_names], out=scratch)
+        np.subtract(scratch, oracle_data, out=scratch)
+        np.abs(scratch, out=scratch)
+        np.less_equal(scratch, tol, out=mask)
+        if mask.all():
+            for name in result_names:
+                print_utils.success(f"Result matched the oracle for tensor '{name}'")
+            return True
 
-def check_results(results, oracles) -> bool:
     all_okay = True
-    for result_key, result in results.items():
-        oracle = oracles[result_key]
+    for name in result_names:
+        if name not in results:
+            print_utils.err(f"Missing result for tensor '{name}'")
+            all_okay = False
+            continue
         try:
-            np.testing.assert_allclose(result, oracle, rtol=1e-5)
+            np.testing.assert_allclose(results[name], oracle_data, rtol=RTOL)
         except AssertionError as exc:
-            print_utils.err(f"Result mismatch for tensor '{result_key}' =>")
+            print_utils.err(f"Result mismatch for tensor '{name}' =>")
             print_utils.warn(f"Comparing (result, oracle): {exc}")
             all_okay = False
             continue
-        print_utils.success(f"Result matched the oracle for tensor '{result_key}'")
+        print_utils.success(f"Result matched the oracle for tensor '{name}'")
     return all_okay
 
 
 def create_input_tensors(shape, dtype, num_devs):
+    import groq.api as g
+
     # Create an input tensor for each device.
     input_tensors = []
     for dev_num in range(num_devs):
@@ -56,7 +137,10 @@ def create_input_tensors(shape, dtype, num_devs):
     return input_tensors
 
 
-def build_program(user_config, pgm_pkg, prog_name, speed):
+def build_program(user_config, pgm_pkg, prog_name, speed, shape, dtype):
+    import groq.api as g
+    from groq.common import print_utils
+
     # Setup multi-chip topology and create a new program context.
     topo = g.configure_topology(config=user_config, speed=speed)
     print_utils.infoc(
@@ -65,8 +149,6 @@ def build_program(user_config, pgm_pkg, prog_name, speed):
     pg_ctx = pgm_pkg.create_program_context(prog_name, topo)
 
     with pg_ctx:
-        shape = (100, 320)
-        dtype = g.float32
         num_devs = pg_ctx.num_devices()
 
         # Initialize tensors.
@@ -82,22 +164,79 @@ def build_program(user_config, pgm_pkg, prog_name, speed):
     return input_tensors, result_tensors
 
 
+def get_sdk_version():
+    import groq.api as g
+
+    version = getattr(g, "__version__", None)
+    if version is None:
+        try:
+            version = importlib.metadata.version("groq-devtools")
+        except importlib.metadata.PackageNotFoundError:
+            return None
+    return str(version)
+
+
+def get_cached_pkg_dir(pkg_name, topo_str, prog_name):
+    # Keep a single cache slot per topology and program, so that stale
+    # packages are overwritten instead of accumulating.
+    from groq.common.config import config
+
+    pkg_dir = os.path.join(config.get_tmp_dir(pkg_name), "cache", topo_str, prog_name)
+    os.makedirs(pkg_dir, exist_ok=True)
+    return pkg_dir
+
+
+def get_pkg_cache_key(user_config, prog_name, speed, shape, dtype):
+    # Key the package on everything that affects the assembled program,
+    # including the groq SDK version and this script's source. Returns None
+    # if the SDK version is unknown, in which case the package is not reused.
+    sdk_version = get_sdk_version()
+    if sdk_version is None:
+        return None
+    with open(__file__, "rb") as f:
+        source = f.read()
+    key = repr(
+        (sdk_version, str(user_config), prog_name, speed, tuple(shape), str(dtype))
+    )
+    return hashlib.sha256(source + key.encode()).hexdigest()
+
+
+def read_assembled_key(pkg_dir):
+    try:
+        with open(os.path.join(pkg_dir, ASSEMBLED_MARKER)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def assemble_cached_pkg(pgm_pkg, pkg_name, pkg_dir, cache_key):
+    from groq.common import print_utils
+
+    assembled_marker = os.path.join(pkg_dir, ASSEMBLED_MARKER)
+    if cache_key is not None and read_assembled_key(pkg_dir) == cache_key:
+        print_utils.infoc(f"Reusing assembled package '{pkg_name}' ...")
+        return
+
+    if cache_key is None:
+        print_utils.warn("Unknown groq SDK version, package will not be reused")
+    # Invalidate the slot first so a failed assemble is never reused.
+    if os.path.exists(assembled_marker):
+        os.remove(assembled_marker)
+    print_utils.infoc(f"Assembling multi-device package '{pkg_name}' ...")
+    pgm_pkg.assemble()
+    if cache_key is not None:
+        with open(assembled_marker, "w") as f:
+            f.write(cache_key)
+
+
 def get_config_from_topo_str(topo_str):
-    if topo_str == "A11_2C":
-        return g.TopologyConfig.FC2_A11_2_CHIP
-    elif topo_str == "A11_4C":
-        return g.TopologyConfig.FC2_A11_4_CHIP
-    elif topo_str == "A14_2C":
-        return g.TopologyConfig.DF_A14_2_CHIP
-    elif topo_str == "A14_4C":
-        return g.TopologyConfig.DF_A14_4_CHIP
-    elif topo_str == "A14_8C":
-        return g.TopologyConfig.DF_A14_8_CHIP
-    else:
-        assert False, f"Unsupported topology {topo_str}"
+    import groq.api as g
 
+    return getattr(g.TopologyConfig, TOPOLOGY_CONFIGS[topo_str])
 
-if __name__ == "__main__":
+
+def main():
+    """Builds, assembles and runs the C2C all-reduce program."""
     parser = argparse.ArgumentParser(
         description="C2C All-Reduce example",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -111,7 +250,7 @@ if __name__ == "__main__":
         "--topo_str",
         type=str,
         default="A11_4C",
-        choices=["A11_2C", "A11_4C", "A14_2C", "A14_4C", "A14_8C"],
+        choices=list(TOPOLOGY_CONFIGS),
         help="Topology type to run this C2C program: \n",
     )
     parser.add_argument(
@@ -134,27 +273,60 @@ if __name__ == "__main__":
         choices=[0, 1, 2, 3],
         help="Topology instance on the node\n",
     )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=0,
+        help="Seconds to wait once before the first iteration\n",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse a previously assembled program package if nothing changed\n",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for the random input data\n",
+    )
     args = parser.parse_args()
 
+    import groq.api as g
+    import groq.runner.tsp as tsp  # pylint: disable=import-error
+    from groq.common import print_utils
+    from groq.common.config import config
+
     # Step 1: Instantiate a program package to store multi-chip (C2C)
     # or single-chip programs.
     pkg_name = "c2c_pkg"
-    pkg_dir = config.get_tmp_dir(pkg_name)
+    prog_name = "c2c_all_reduce"
+    user_config = get_config_from_topo_str(args.topo_str)
+    shape = (100, 320)
+    dtype = g.float32
+    if args.cache:
+        pkg_dir = get_cached_pkg_dir(pkg_name, args.topo_str, prog_name)
+    else:
+        pkg_dir = config.get_tmp_dir(pkg_name)
     print_utils.infoc(f"Creating a program package '{pkg_name}' at '{pkg_dir}' ...")
     pgm_pkg = g.ProgramPackage(name=pkg_name, output_dir=pkg_dir)
 
     # Step 2: Build your multi-chip C2C program.
-    prog_name = "c2c_all_reduce"
-    user_config = get_config_from_topo_str(args.topo_str)
     input_tensors, result_tensors = build_program(
-        user_config, pgm_pkg, prog_name, args.speed
+        user_config, pgm_pkg, prog_name, args.speed, shape, dtype
     )
 
     # You are free to add more multi-chip or single-chip programs to the package.
 
-    # Step 3: Assemble all programs in the multi-device package.
-    print_utils.infoc(f"Assembling multi-device package '{pkg_name}' ...")
-    pgm_pkg.assemble()
+    # Step 3: Assemble all programs in the multi-device package. With --cache,
+    # assembly is skipped if an identical package was already assembled by a
+    # previous run.
+    if args.cache:
+        cache_key = get_pkg_cache_key(user_config, prog_name, args.speed, shape, dtype)
+        assemble_cached_pkg(pgm_pkg, pkg_name, pkg_dir, cache_key)
+    else:
+        print_utils.infoc(f"Assembling multi-device package '{pkg_name}' ...")
+        pgm_pkg.assemble()
 
     # Step 4 [Optional]: Bringup the c2c links before we run the program.
     # link up procedure is now embedded in multi_tsp_runner, it will
@@ -187,18 +359,31 @@ if __name__ == "__main__":
         sys.exit(1)
 
     # Step 6: Pass inputs to the runner and execute the program on HW.
-    inputs, oracles = create_data(input_tensors, result_tensors)
+    seed_seq = np.random.SeedSequence(args.seed)
+    inputs, oracle_data, result_names = create_data(
+        input_tensors, result_tensors, seed_seq
+    )
+    # The runner allocates its own outputs, so reuse the validation buffers
+    # across iterations instead.
+    check_buffers = create_check_buffers(oracle_data, len(result_names))
     print_utils.infoc(f"Executing C2C program '{prog_name}' ...")
     try:
+        if args.settle > 0:
+            time.sleep(args.settle)
         for i in range(args.iter):
             print_utils.infoc(f"Testing for iteration: {i}")
-            time.sleep(0.5)
             results = runner(**inputs)
 
             # Validation: Compare against oracle.
             print_utils.infoc("Validating results ...")
-            assert check_results(results, oracles), "Validation failed!"
+            assert check_results(
+                results, oracle_data, result_names, check_buffers
+            ), "Validation failed!"
     except KeyboardInterrupt:
         print_utils.infoc("Program Interrupted... Terminating the program")
     finally:
         print_utils.infoc("Test run completed")
+
+
+if __name__ == "__main__":
+    main()
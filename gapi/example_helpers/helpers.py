@@ -1,11 +1,23 @@
+import functools
 import subprocess
 import re
 import shutil
 import os
+from pathlib import Path
 
 from numpy import False_
 from groq.common import print_utils
 
+APT_INSTALLED_RE = re.compile(r"(?<=Installed: ).*")
+DNF_VERSION_RE = re.compile(r"(?<=Version ).*")
+
+
+def _get_os_id():
+    # /etc/os-release is a list of KEY=value lines, values may be quoted
+    os_release = Path("/etc/os-release").read_text().splitlines()
+    info = dict(line.split("=", 1) for line in os_release if "=" in line)
+    return info.get("ID", "").strip("\"'")
+
 
 def find_sdk(package: str):
     sdk_available = False
@@ -15,11 +27,14 @@ def find_sdk(package: str):
         sdk_available = True
         return sdk_available
 
-    cmd = ["cat", "/etc/os-release"]
-    apt_cache_policy = subprocess.check_output(cmd).decode("utf-8").split("\n")
-    ubuntu = re.search("Ubuntu", apt_cache_policy[0])
-    rocky = re.search("Rocky Linux", apt_cache_policy[0])
-    if ubuntu:
+    # The package probe is cached since installed packages do not change at runtime
+    return _find_installed_sdk(package)
+
+
+@functools.lru_cache(maxsize=None)
+def _find_installed_sdk(package: str):
+    os_id = _get_os_id()
+    if os_id in ("ubuntu", "debian"):
         cmd = ["apt-cache", "policy", package]
         apt_cache_policy = subprocess.check_output(cmd).decode("utf-8").split("\n")
         if len(apt_cache_policy) == 1:
@@ -28,10 +43,10 @@ def find_sdk(package: str):
             )
             return False
         else:
-            sdk_version = re.search(r"(?<=Installed: ).*", apt_cache_policy[1]).group()
+            sdk_version = APT_INSTALLED_RE.search(apt_cache_policy[1]).group()
             if sdk_version != "None":
                 return True
-    elif rocky:
+    elif os_id == "rocky":
         cmd = ["dnf", "info", "groq-devtools"]
         dnf_cache_policy = subprocess.check_output(cmd).decode("utf-8").split("\n")
         if len(dnf_cache_policy) == 1:
@@ -40,11 +55,33 @@ def find_sdk(package: str):
             )
             return False
         else:
-            sdk_version = re.search(r"(?<=Version ).*", dnf_cache_policy[3])
+            sdk_version = DNF_VERSION_RE.search(dnf_cache_policy[3])
             if sdk_version != "None":
                 return True
 
 
+# Unique registered vendor id: 1de0, and device id: "0000"
+GROQ_CARD_ID = "1de0:0000"
+
+# number of chips per device: "1de0:0000":1
+CHIPS_PER_CARD = 1
+
+
+@functools.lru_cache(maxsize=1)
+def _get_num_chips_from_lspci():
+    # Capture the pci devices on the system using the linux lspci utility and
+    # count the GroqCards directly in the raw output
+    lspci_output = subprocess.check_output(["lspci", "-n"])
+    num_cards = lspci_output.count(GROQ_CARD_ID.encode())
+    return num_cards * CHIPS_PER_CARD
+
+
+def _count_chips(pci_devices):
+    # Sum the number of GroqCards in the list of devices
+    num_cards = sum(1 for device in pci_devices if GROQ_CARD_ID in device)
+    return num_cards * CHIPS_PER_CARD
+
+
 def get_num_chips_available(pci_devices=None):
 
     INTERNAL = os.getenv("INTERNAL")
@@ -53,30 +90,13 @@ def get_num_chips_available(pci_devices=None):
         chips_available = "True"
         return chips_available
 
+    if pci_devices is not None:
+        return _count_chips(pci_devices)
+
     # Check if we have access to lspci
     if not shutil.which("lspci"):
         print("No access to lspci")
         return
 
-    # Capture the list of pci devices on the system using the linux lspci utility
-    if pci_devices is None:
-        pci_devices = (
-            subprocess.check_output(["lspci", "-n"]).decode("utf-8").split("\n")
-        )
-
-    # Unique registered vendor id: 1de0, and device id: "0000"
-    groq_card_id = "1de0:0000"
-
-    # number of chips per device: "1de0:0000":1
-    chips_per_card = 1
-
-    # Sum the number of GroqCards in the list of devices
-    num_cards = 0
-    for device in pci_devices:
-        if groq_card_id in device:
-            num_cards += 1
-
-    # Calculate total number of chips
-    num_chips_available = num_cards * chips_per_card
-
-    return num_chips_available
+    # The lspci scan is cached since the set of cards does not change at runtime
+    return _get_num_chips_from_lspci()
@@ -5,7 +5,6 @@ output to the memory so that it can be consumed by the subsequent stage. By mark
 as buffered, we don't need to specify the time for the second and third stages.
 
 """
-import os
 import numpy as np
 
 import groq.api as g
@@ -55,22 +54,25 @@ def compile(shape):
 
 def run(iop_file, shape):
 
-    np.set_printoptions(linewidth=1000, threshold=10000)
-
-    if not os.path.exists(iop_file):
-        raise Exception(f"IOP file does not exist: {iop_file}")
-
     print(f"Running programs from {iop_file}")
 
-    a_data = (np.random.rand(*shape)).astype(np.float16)
-    b_data = (np.random.rand(*shape)).astype(np.float16)
-    c_data = (np.random.rand(*shape)).astype(np.float32)
-    mac_program = tsp.create_tsp_runner(iop_file)
+    rng = np.random.default_rng()
+    a_data = rng.random(size=shape, dtype=np.float32).astype(np.float16, copy=False)
+    b_data = rng.random(size=shape, dtype=np.float32).astype(np.float16, copy=False)
+    c_data = rng.random(size=shape, dtype=np.float32)
+    try:
+        mac_program = tsp.create_tsp_runner(iop_file)
+    except FileNotFoundError as e:
+        raise Exception(f"IOP file does not exist: {iop_file}") from e
 
     result = mac_program(A=a_data, B=b_data, C=c_data)
 
-    ab_oracle = np.matmul(a_data, b_data, dtype=np.float32)
-    oracle = np.add(ab_oracle, c_data)
+    # Upcast the fp16 inputs once and accumulate c into the fp32 matmul
+    # output in place to avoid a second full-size temporary.
+    a32 = a_data.astype(np.float32, copy=False)
+    b32 = b_data.astype(np.float32, copy=False)
+    oracle = a32 @ b32
+    oracle += c_data
     np.testing.assert_allclose(result["final_result"], oracle, atol=0.01)
 
 